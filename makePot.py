@@ -5,118 +5,204 @@
 # License: GNU General Public License version 2.0
 
 import re
-from collections import OrderedDict
 import itertools
-
-# Maps (context, msgid) to a dict of message data. We need this so we output
-# only one entry for each message.
-messages = OrderedDict()
+import io
 
 def makePot(target, source, env):
-	global messages
-	out = open(target[0].path, "wt", encoding="UTF-8")
-	out.write(
+	# Use a new builder each time so that nothing is left over from a previous
+	# build in the same process.
+	builder = PotBuilder()
+	for s in source:
+		builder.merge(parseFile(s.path))
+	with open(target[0].path, "wt", encoding="UTF-8") as out:
+		builder.write(out)
+
+def parseFile(path):
+	"""Parse a single source file, returning a PotBuilder containing only its
+	messages. Files don't share any state, so a translators comment can't leak
+	from the end of one file into the next.
+	"""
+	builder = PotBuilder()
+	with open(path, "rt", encoding="UTF-8") as inp:
+		if path.endswith(".cpp"):
+			builder.addCpp(inp)
+		elif path.endswith(".rc"):
+			builder.addRc(inp)
+	return builder
+
+def mergeComments(data, comments):
+	# The same comment may precede several occurrences of a message. Only
+	# output it once.
+	data["comments"] = list(dict.fromkeys(itertools.chain(
+		data.get("comments", ()), comments)))
+
+RE_TRANSLATORS_COMMENT = re.compile(r"^\s*// Translators: (.*)$")
+RE_COMMENT = re.compile(r"^\s*// (.*)$")
+RE_CPP_TRANSLATE_FIRST_STRING = re.compile(r'^\s*[^/].*?"(?P<msgid>.*?)"')
+# A single pattern which finds everything we care about in a C++ file, so the
+# whole file can be scanned in one pass rather than line by line. Group names
+# can't be repeated, so each alternative has its own. Every alternative starts
+# with a literal so the regex engine can skip quickly to candidates. Anchors
+# like ^ and \b defeat that, so addCpp checks those conditions itself.
+RE_CPP_TRANSLATE = re.compile(
+	r'// (?:'
+		# A translators comment, including any comment lines which continue it.
+		r'Translators: (?P<translatorsComment>.*(?:\n[ \t]*// .*)*)'
+		r'|translate firstString begin\n'
+		r'(?P<firstString>[\s\S]*?)'
+		r'^[ \t]*// translate firstString end$'
+	r')|translate(?:'
+		r'\("(?P<msgid>.*?)"\)'
+		r'|_ctxt\("(?P<ctxtContext>.*?)",\s*"(?P<ctxtMsgid>.*?)"\)'
+		r'|_plural\("(?P<pluralMsgid>.*?)",\s*"(?P<plural>.*?)", .*?\)'
+	r')',
+	re.MULTILINE
+)
+RC_TRANSLATE_COMMANDS = ("CAPTION", "LTEXT", "DEFPUSHBUTTON", "PUSHBUTTON", "GROUPBOX", "CONTROL")
+# rc strings escape a quote by doubling it.
+RE_RC_TRANSLATE = re.compile(r'^\s*(?P<command>%s)\s+"(?P<msgid>(?:[^"]|"")*)"'
+	% "|".join(RC_TRANSLATE_COMMANDS))
+
+class PotBuilder:
+	"""Collects messages from source files and writes them as a pot template.
+	"""
+
+	def __init__(self):
+		# Maps (context, msgid) to a dict of message data. We need this so we
+		# output only one entry for each message.
+		self.messages = {}
+		self.inTranslatorsComment = False
+		self.lastTranslatorsComment = []
+
+	def write(self, out):
+		parts = [
 r"""msgid ""
 msgstr ""
 "Content-Type: text/plain; charset=UTF-8\n"
 "Content-Transfer-Encoding: 8bit\n"
 
 """
-	)
-	for s in source:
-		s = s.path
-		inp = open(s, "rt", encoding="UTF-8")
-		if s.endswith(".cpp"):
-			addCpp(inp)
-		elif s.endswith(".rc"):
-			addRc(inp)
-	for (context, msgid), data in messages.items():
-		for comment in data.get("comments", ()):
-			out.write('#. %s\n' % comment)
-		if context:
-			out.write('msgctxt "%s"\n' % context)
-		out.write('msgid "%s"\n' % data["msgid"])
-		if "plural" in data:
-			out.write('msgid_plural "%s"\n' % data["plural"])
-			out.write('msgstr[0] ""\n')
-			out.write('msgstr[1] ""\n')
-		else:
-			out.write('msgstr ""\n')
-		out.write("\n")
+		]
+		for (context, msgid), data in self.messages.items():
+			comments = "".join(f"#. {comment}\n" for comment in data.get("comments", ()))
+			ctxt = f'msgctxt "{context}"\n' if context else ""
+			if "plural" in data:
+				msgstr = f'msgid_plural "{data["plural"]}"\nmsgstr[0] ""\nmsgstr[1] ""\n'
+			else:
+				msgstr = 'msgstr ""\n'
+			parts.append(f'{comments}{ctxt}msgid "{data["msgid"]}"\n{msgstr}\n')
+		out.writelines(parts)
 
-RE_TRANSLATORS_COMMENT = re.compile(r"^\s*// Translators: (.*)$")
-RE_COMMENT = re.compile(r"^\s*// (.*)$")
-inTranslatorsComment = False
-lastTranslatorsComment = []
-def handleTranslatorsComment(line):
-	global inTranslatorsComment, lastTranslatorsComment
-	m = RE_TRANSLATORS_COMMENT.match(line)
-	if m:
-		inTranslatorsComment = True
-		lastTranslatorsComment.append(m.group(1))
-		return True
-	if inTranslatorsComment:
-		m = RE_COMMENT.match(line)
+	def handleTranslatorsComment(self, line):
+		if "// " not in line:
+			# Neither regex below can match, so don't bother running them.
+			self.inTranslatorsComment = False
+			return False
+		m = RE_TRANSLATORS_COMMENT.match(line)
 		if m:
-			lastTranslatorsComment.append(m.group(1))
+			self.inTranslatorsComment = True
+			self.lastTranslatorsComment.append(m.group(1))
 			return True
-		else:
-			inTranslatorsComment = False
-	return False
+		if self.inTranslatorsComment:
+			m = RE_COMMENT.match(line)
+			if m:
+				self.lastTranslatorsComment.append(m.group(1))
+				return True
+			else:
+				self.inTranslatorsComment = False
+		return False
 
-def addMessage(data):
-	global messages, lastTranslatorsComment
-	key = (data.get("context"), data["msgid"])
-	data = messages.setdefault(key, data)
-	if lastTranslatorsComment:
-		comments = data.setdefault("comments", [])
-		comments.extend(lastTranslatorsComment)
-		lastTranslatorsComment = []
+	def addMessage(self, data):
+		key = (data.get("context"), data["msgid"])
+		data = self.messages.setdefault(key, data)
+		if self.lastTranslatorsComment:
+			mergeComments(data, self.lastTranslatorsComment)
+			self.lastTranslatorsComment = []
 
-RE_CPP_TRANSLATE_FIRST_STRING_END = re.compile(r"^\s*// translate firstString end$")
-RE_CPP_TRANSLATE_FIRST_STRING = re.compile(r'^\s*[^/].*?"(?P<msgid>.*?)"')
-def addCppTranslateFirstString(input):
-	for line in input:
-		if handleTranslatorsComment(line):
-			continue
-		if RE_CPP_TRANSLATE_FIRST_STRING_END.match(line):
-			break
-		m = RE_CPP_TRANSLATE_FIRST_STRING.match(line)
-		if m:
-			data = m.groupdict()
-			addMessage(data)
+	def merge(self, other):
+		"""Add the messages from another builder, keeping the order in which they
+		were first seen.
+		"""
+		for key, data in other.messages.items():
+			existing = self.messages.setdefault(key, data)
+			if existing is not data and "comments" in data:
+				mergeComments(existing, data["comments"])
 
-RE_CPP_TRANSLATE = re.compile(r'\btranslate\("(?P<msgid>.*?)"\)')
-RE_CPP_TRANSLATE_CTXT = re.compile(r'\btranslate_ctxt\("(?P<context>.*?)",\s*"(?P<msgid>.*?)\)')
-RE_CPP_TRANSLATE_PLURAL = re.compile(r'\btranslate_plural\("(?P<msgid>.*?)",\s*"(?P<plural>.*?)", .*?\)')
-RE_CPP_TRANSLATE_FIRST_STRING_BEGIN = re.compile(r"^\s*// translate firstString begin$")
-def addCpp(input):
-	for line in input:
-		if handleTranslatorsComment(line):
-			continue
-		if RE_CPP_TRANSLATE_FIRST_STRING_BEGIN.match(line):
-			addCppTranslateFirstString(input)
-			continue
-		matches = itertools.chain(RE_CPP_TRANSLATE.finditer(line),
-			RE_CPP_TRANSLATE_CTXT.finditer(line),
-			RE_CPP_TRANSLATE_PLURAL.finditer(line))
-		for m in matches:
-			addMessage(m.groupdict())
+	def addCppTranslateFirstString(self, lines):
+		for line in lines:
+			if self.handleTranslatorsComment(line):
+				continue
+			m = RE_CPP_TRANSLATE_FIRST_STRING.match(line)
+			if m:
+				data = m.groupdict()
+				self.addMessage(data)
 
-RE_RC_TRANSLATE = re.compile(r'^\s*(?P<command>CAPTION|LTEXT|DEFPUSHBUTTON|PUSHBUTTON|GROUPBOX|CONTROL)\s+"(?P<msgid>.*?)"')
-def addRc(input):
-	context = None
-	for line in input:
-		if handleTranslatorsComment(line):
-			continue
-		m = RE_RC_TRANSLATE.match(line)
-		if m:
-			data = m.groupdict()
-			if data["command"] == "CAPTION":
-				context = data["msgid"]
-			if not context:
-				raise RuntimeError("No caption before messages")
-			if not data["msgid"]:
+	def addCpp(self, input):
+		text = input.read()
+		pos = 0
+		while True:
+			m = RE_CPP_TRANSLATE.search(text, pos)
+			if not m:
+				break
+			start = m.start()
+			if text.startswith("//", start):
+				# These comments only count if they're on a line of their own.
+				lineStart = text.rfind("\n", 0, start) + 1
+				valid = not text[lineStart:start].strip()
+			else:
+				# translate must be at a word boundary.
+				valid = start == 0 or not (text[start - 1].isalnum() or text[start - 1] == "_")
+			if not valid:
+				# Try again from the next character so we don't skip anything this
+				# match consumed.
+				pos = start + 1
+				continue
+			pos = m.end()
+			comment = m.group("translatorsComment")
+			if comment is not None:
+				# Only split at \n, since that's all the pattern treats as a line end.
+				# splitlines would also split at characters such as form feed.
+				first, *rest = comment.split("\n")
+				self.lastTranslatorsComment.append(first)
+				for line in rest:
+					# A continuation line might start another translators comment. As in
+					# handleTranslatorsComment, strip that prefix too.
+					lineMatch = RE_TRANSLATORS_COMMENT.match(line) or RE_COMMENT.match(line)
+					self.lastTranslatorsComment.append(lineMatch.group(1))
+			elif m.group("firstString") is not None:
+				# Iterating a StringIO with newline="\n" splits lines the same way as
+				# reading the file did.
+				self.addCppTranslateFirstString(
+					io.StringIO(m.group("firstString"), newline="\n"))
+			elif m.group("ctxtMsgid") is not None:
+				self.addMessage({"context": m.group("ctxtContext"),
+					"msgid": m.group("ctxtMsgid")})
+			elif m.group("plural") is not None:
+				self.addMessage({"msgid": m.group("pluralMsgid"),
+					"plural": m.group("plural")})
+			else:
+				self.addMessage({"msgid": m.group("msgid")})
+
+	def addRc(self, input):
+		context = None
+		for line in input:
+			if self.handleTranslatorsComment(line):
+				continue
+			# Most lines don't contain translatable strings. Rejecting those with
+			# startswith is much cheaper than a failed regex match.
+			if not line.lstrip().startswith(RC_TRANSLATE_COMMANDS):
 				continue
-			data["context"] = context
-			addMessage(data)
+			m = RE_RC_TRANSLATE.match(line)
+			if m:
+				data = m.groupdict()
+				# Other escapes in rc strings are the same as C and thus the same as
+				# po, but po escapes quotes with a backslash.
+				data["msgid"] = data["msgid"].replace('""', r'\"')
+				if data["command"] == "CAPTION":
+					context = data["msgid"]
+				if not context:
+					raise RuntimeError("No caption before messages")
+				if not data["msgid"]:
+					continue
+				data["context"] = context
+				self.addMessage(data)
@@ -0,0 +1,100 @@
+# OSARA: Open Source Accessibility for the REAPER Application
+# Unit tests for makePot
+# License: GNU General Public License version 2.0
+
+import io
+import os.path
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from makePot import PotBuilder
+
+class TestAddCpp(unittest.TestCase):
+
+	def addCpp(self, text):
+		builder = PotBuilder()
+		builder.addCpp(io.StringIO(text))
+		return builder.messages
+
+	def test_translatorsCommentKeepsFormFeed(self):
+		messages = self.addCpp('// Translators: a\x0cb\nx = translate("m");\n')
+		self.assertEqual(messages[(None, "m")]["comments"], ["a\x0cb"])
+
+	def test_translatorsCommentContinuationKeepsLineSeparator(self):
+		messages = self.addCpp(
+			'// Translators: a\n// b\u2028c\nx = translate("m");\n')
+		self.assertEqual(messages[(None, "m")]["comments"], ["a", "b\u2028c"])
+
+	def test_adjacentTranslatorsComments(self):
+		messages = self.addCpp(
+			'// Translators: first.\n// Translators: second.\nx = translate("m");\n')
+		self.assertEqual(messages[(None, "m")]["comments"], ["first.", "second."])
+
+	def test_firstStringOnlySplitsAtNewline(self):
+		messages = self.addCpp(
+			'// translate firstString begin\n'
+			'\t{"one", 1},\x0c{"two", 2},\n'
+			'// translate firstString end\n')
+		self.assertEqual(list(messages), [(None, "one")])
+
+	def test_ctxtArgumentsMaySpanLines(self):
+		messages = self.addCpp('x = translate_ctxt("ctx",\n\t"m");\n')
+		self.assertEqual(list(messages), [("ctx", "m")])
+
+	def test_firstStringBeginWithoutEndIgnored(self):
+		messages = self.addCpp(
+			'// translate firstString begin\n'
+			'\t{"notFirstString", 1},\n'
+			'x = translate("m");\n')
+		self.assertEqual(list(messages), [(None, "m")])
+
+	def test_mixedCallsOnLineAddedInSourceOrder(self):
+		messages = self.addCpp(
+			'// Translators: c\n'
+			'f(translate_plural("p", "ps", n), translate("a"));\n')
+		self.assertEqual(list(messages), [(None, "p"), (None, "a")])
+		self.assertEqual(messages[(None, "p")]["comments"], ["c"])
+		self.assertNotIn("comments", messages[(None, "a")])
+
+class TestAddRc(unittest.TestCase):
+
+	def addRc(self, text):
+		builder = PotBuilder()
+		builder.addRc(io.StringIO(text))
+		return builder.messages
+
+	def test_doubledQuotesBecomePoEscapes(self):
+		messages = self.addRc('CAPTION "Say ""hi"""\n')
+		self.assertEqual(list(messages), [(r'Say \"hi\"', r'Say \"hi\"')])
+
+	def test_emptyStringSkipped(self):
+		messages = self.addRc('CAPTION "Dlg"\nCONTROL "", X, "Btn"\n')
+		self.assertEqual(list(messages), [("Dlg", "Dlg")])
+
+class TestMerge(unittest.TestCase):
+
+	def builder(self, text):
+		builder = PotBuilder()
+		builder.addCpp(io.StringIO(text))
+		return builder
+
+	def test_mergeKeepsFirstSeenOrderAndDedupesComments(self):
+		merged = PotBuilder()
+		merged.merge(self.builder(
+			'// Translators: one\nx = translate("a");\ny = translate("b");\n'))
+		merged.merge(self.builder(
+			'x = translate("c");\n'
+			'// Translators: one\n// two\ny = translate("a");\n'))
+		self.assertEqual(list(merged.messages),
+			[(None, "a"), (None, "b"), (None, "c")])
+		self.assertEqual(merged.messages[(None, "a")]["comments"], ["one", "two"])
+
+	def test_translatorsCommentDoesNotCarryAcrossBuilders(self):
+		merged = PotBuilder()
+		merged.merge(self.builder('// Translators: dangling\n'))
+		merged.merge(self.builder('x = translate("m");\n'))
+		self.assertNotIn("comments", merged.messages[(None, "m")])
+
+if __name__ == "__main__":
+	unittest.main()